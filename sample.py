@@ -1,5 +1,8 @@
 from rdkit import Chem
 
+import torch
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import random
 import numpy as np
 import logging
@@ -42,9 +45,22 @@ def run_generator(generator, scaffold_mol, seed, returnMol = False, verbose = Tr
         return None
     return generated_mol
 
+# Each sample is independent, so samples are generated in forked processes sharing one generator.
+_generator = None
+
+def init_worker() :
+    torch.set_num_threads(1)
+
+def run_generator_worker(task) :
+    scaffold_mol, seed, verbose = task
+    return run_generator(_generator, scaffold_mol, seed, verbose = verbose)
+
 def main() : 
+    global _generator
     # Set Generator
     generator, args = setup_generator()
+    if args.num_workers > 1 and 'fork' not in multiprocessing.get_all_start_methods() :
+        raise ValueError('--num_workers > 1 requires the fork start method (POSIX only)')
 
     # Set Output File
     if args.output_path not in [None, 'null'] :
@@ -67,44 +83,61 @@ def main() :
     if args.seed is None :
         args.seed = random.randint(0, 1e6)
 
-    # Start
-    global_st = time.time()
-    global_success = 0
-    for scaf_idx, scaffold_smi in enumerate(scaffold_list) :
-        # Encoding Scaffold Molecule
-        if scaffold_smi is not None :
-            scaffold_mol = Chem.MolFromSmiles(scaffold_smi)
-            print(f"[{scaf_idx+1}/{len(scaffold_list)}]")
-            print(f"Scaffold: {scaffold_smi}")
-        else :
-            print(f"Non-Scaffold Generation")
-            scaffold_mol = None
-
-        local_st = time.time()
-        success = 0
-        for i in range(args.num_samples) :
-            seed = args.seed + i
-            if not args.q :
-                print(f"{i+1}th Generation... (Seed {seed})")
-            generated_smiles = run_generator(generator, scaffold_mol, seed, verbose = args.verbose)
-
-            if generated_smiles is None :
-                if not args.q :
-                    print("FAIL\n")
-                out_writer.write('\n')
+    # Set Worker Processes
+    if args.num_workers > 1 :
+        _generator = generator
+        # ProcessPoolExecutor raises BrokenProcessPool if a worker dies instead of waiting forever.
+        pool = ProcessPoolExecutor(args.num_workers, mp_context = multiprocessing.get_context('fork'),
+                                   initializer = init_worker)
+    else :
+        pool = None
+
+    try :
+        # Start
+        global_st = time.time()
+        global_success = 0
+        for scaf_idx, scaffold_smi in enumerate(scaffold_list) :
+            # Encoding Scaffold Molecule
+            if scaffold_smi is not None :
+                scaffold_mol = Chem.MolFromSmiles(scaffold_smi)
+                print(f"[{scaf_idx+1}/{len(scaffold_list)}]")
+                print(f"Scaffold: {scaffold_smi}")
             else :
+                print(f"Non-Scaffold Generation")
+                scaffold_mol = None
+
+            local_st = time.time()
+            success = 0
+            seeds = [args.seed + i for i in range(args.num_samples)]
+            if pool is not None :
+                results = pool.map(run_generator_worker, [(scaffold_mol, seed, args.verbose) for seed in seeds])
+            for i, seed in enumerate(seeds) :
                 if not args.q :
-                    print(f"Finish\t{generated_smiles}\n")
-                out_writer.write(generated_smiles+'\n')
-                success += 1
-
-        local_end = time.time() 
-        time_cost = local_end - local_st 
-        global_success += success
-        print(f"Num Generated Mol: {success}") 
-        print(f"Time Cost: {time_cost:.3f}, {time_cost/args.num_samples:.3f}\n")
-
-    out_writer.close()
+                    print(f"{i+1}th Generation... (Seed {seed})")
+                if pool is not None :
+                    generated_smiles = next(results)
+                else :
+                    generated_smiles = run_generator(generator, scaffold_mol, seed, verbose = args.verbose)
+
+                if generated_smiles is None :
+                    if not args.q :
+                        print("FAIL\n")
+                    out_writer.write('\n')
+                else :
+                    if not args.q :
+                        print(f"Finish\t{generated_smiles}\n")
+                    out_writer.write(generated_smiles+'\n')
+                    success += 1
+
+            local_end = time.time() 
+            time_cost = local_end - local_st 
+            global_success += success
+            print(f"Num Generated Mol: {success}") 
+            print(f"Time Cost: {time_cost:.3f}, {time_cost/args.num_samples:.3f}\n")
+    finally :
+        out_writer.close()
+        if pool is not None :
+            pool.shutdown(wait = False, cancel_futures = True)
     global_end = time.time()
 
     if len(scaffold_list) > 1 :
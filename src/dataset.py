@@ -12,10 +12,9 @@ from .utils import feature, brics
 RDLogger.DisableLog('rdApp.*')
 
 class MolBlockPairDataset(Dataset) :
-    def __init__(self, data_file: str, cond_module, max_atoms: int) :
+    def __init__(self, data_file: str, cond_module) :
         super(MolBlockPairDataset, self).__init__()
         self.cond_module = cond_module
-        self.max_atoms = max_atoms
         data = pd.read_csv(data_file)
         self.mol = data.SMILES.to_numpy()
         self.frag_id = data.FID.to_numpy()
@@ -33,8 +32,8 @@ class MolBlockPairDataset(Dataset) :
 
         mol_smiles = self.mol[idx]
         mol = Chem.MolFromSmiles(mol_smiles)
-        v = feature.get_atom_features(mol, self.max_atoms, brics=False)
-        adj = feature.get_adj(mol, self.max_atoms)
+        v = feature.get_atom_features(mol, brics=False)
+        adj = feature.get_adj(mol)
 
         molID = self.molID[idx]
         if self.cond_module :
@@ -43,3 +42,21 @@ class MolBlockPairDataset(Dataset) :
             cond = torch.Tensor([])
         
         return v, adj, cond, y_frag, y_idx 
+
+    @staticmethod
+    def collate_fn(batch: List[Tuple]) :
+        """
+        Pad node features and adjacency matrices only up to the largest molecule in the batch.
+        """
+        v_list, adj_list, cond_list, y_frag, y_idx = zip(*batch)
+        max_atoms = max(v.size(0) for v in v_list)
+        v = v_list[0].new_zeros((len(batch), max_atoms, v_list[0].size(1)))
+        adj = adj_list[0].new_zeros((len(batch), max_atoms, max_atoms))
+        for i, (_v, _adj) in enumerate(zip(v_list, adj_list)) :
+            n_atoms = _v.size(0)
+            v[i, :n_atoms] = _v
+            adj[i, :n_atoms, :n_atoms] = _adj
+        cond = torch.stack(cond_list)
+        y_frag = torch.tensor(y_frag, dtype=torch.long)
+        y_idx = torch.tensor(y_idx, dtype=torch.long)
+        return v, adj, cond, y_frag, y_idx
@@ -1,8 +1,8 @@
 import os
+import functools
+from collections import OrderedDict
 import numpy as np
 import torch
-from torch.distributions.categorical import Categorical
-from torch.distributions.bernoulli import Bernoulli
 from torch.utils.data import Dataset, DataLoader
 from torch import BoolTensor
 from rdkit import Chem, RDLogger
@@ -37,17 +37,22 @@ class MoleculeBuilder() :
         library_freq = torch.from_numpy(self.library.freq)
         self.library_freq = library_freq / library_freq.sum()
         self.library_freq_weighted = library_freq ** cfg.alpha
-        self.library_allow_brics_list = self.get_library_allow_brics_list()
         self.n_lib_sample = min(len(self.library), cfg.n_library_sample)
+        self.scaffold_cache = {}
+        self.library_brics_label = torch.tensor([int(label) for label in self.library.brics_label_list])
+        self.get_fragment_candidates = functools.lru_cache(maxsize=32)(self.get_fragment_candidates)
 
         # Setup after self.setup()
         self.target_properties = self.model.cond_keys
         self.cond = None
+        self.scaffold_embedding_cache = OrderedDict()     # small LRU, only consecutive samples reuse it
+        self.scaffold_embedding_cache_size = 8
 
     def setup(self, condition) :
         self.cond = self.model.get_cond(condition).unsqueeze(0)
+        self.scaffold_embedding_cache.clear()
 
-    @torch.no_grad()
+    @torch.inference_mode()
     def generate(
         self,
         scaffold: Union[Mol, str, None],
@@ -86,15 +91,18 @@ class MoleculeBuilder() :
                     print(f"Invalid Scaffold: '{scaffold_smiles}'")
                 return None
 
-        mol = scaffold
+        # Samples from the same scaffold share the first state, so featurize and embed it only once.
+        mol, embedding = self.get_scaffold_embedding(scaffold)
         while step < self.max_iteration :
-            h = feature.get_atom_features(mol, brics=False).unsqueeze(0)
-            adj = feature.get_adj(mol).unsqueeze(0)
+            if embedding is not None :
+                h, adj, _h, Z_mol = embedding
+                embedding = None
+            else :
+                h, adj, _h, Z_mol = self.embed_mol(mol)
 
             # Predict Termination
-            _h, Z_mol = self.model.graph_embedding_mol(h, adj, self.cond)
             p_term = self.model.predict_termination(Z_mol)
-            termination = Bernoulli(probs=p_term).sample().bool().item()
+            termination = torch.bernoulli(p_term).bool().item()
             if termination :
                 self.print_log(verbose, 'FINISH', step, mol)
                 return mol
@@ -108,26 +116,36 @@ class MoleculeBuilder() :
                     use_lib = use_lib.unsqueeze(0)
             prob_dist_fragment = self.model.predict_frag_id(Z_mol, probs=True, use_lib=use_lib).squeeze(0)
                                                                                                     # (N_lib)
+            # Masking fragments below never introduces NaN, so check it once per step.
+            valid = not (torch.isnan(prob_dist_fragment.sum()))
+            if not valid :
+                self.print_log(verbose, 'FAIL', step, mol, log = 'NO_APPROPRIATE_FRAGMENT')
+                return None
+
             compose_success = False
+            idx_mask_cache = {}     # possible indexs only depend on the brics label of fragment
+            prob_dist_idx_cache = {}
             for _ in range(100) :
-                valid = not (torch.isnan(prob_dist_fragment.sum()))
-                if not valid :
-                    self.print_log(verbose, 'FAIL', step, mol, log = 'NO_APPROPRIATE_FRAGMENT')
-                    return None
-
-                idx = Categorical(probs = prob_dist_fragment).sample().item()
+                idx = torch.multinomial(prob_dist_fragment, 1).item()
                 if use_lib is None :
                     fragment_idx = idx
                 else :
                     fragment_idx = use_lib[0, idx].item()
                 fragment = self.library.get_mol(fragment_idx)
                 
-                # Predict Index
-                Z_frag = self.model.Z_lib[fragment_idx].unsqueeze(0)
-                prob_dist_idx = self.model.predict_idx(h, adj, _h, Z_mol, Z_frag, probs=True).squeeze(0)
-                # Masking
-                if self.cfg.idx_masking :
-                    prob_dist_idx.masked_fill_(self.get_idx_mask(mol, fragment), 0)
+                # Predict Index (deterministic in eval mode, so reuse it when the fragment is resampled)
+                if fragment_idx in prob_dist_idx_cache :
+                    prob_dist_idx = prob_dist_idx_cache[fragment_idx]
+                else :
+                    Z_frag = self.model.Z_lib[fragment_idx].unsqueeze(0)
+                    prob_dist_idx = self.model.predict_idx(h, adj, _h, Z_mol, Z_frag, probs=True).squeeze(0)
+                    # Masking
+                    if self.cfg.idx_masking :
+                        brics_label = self.library.brics_label_list[fragment_idx]
+                        if brics_label not in idx_mask_cache :
+                            idx_mask_cache[brics_label] = self.get_idx_mask(mol, fragment)
+                        prob_dist_idx.masked_fill_(idx_mask_cache[brics_label], 0)
+                    prob_dist_idx_cache[fragment_idx] = prob_dist_idx
 
                 valid = (torch.sum(prob_dist_idx).item() > 0)
                 if not valid :
@@ -135,7 +153,7 @@ class MoleculeBuilder() :
                     continue
 
                 # Choose Index
-                atom_idx = Categorical(probs = prob_dist_idx).sample().item()
+                atom_idx = torch.multinomial(prob_dist_idx, 1).item()
 
                 # compose fragments
                 try :
@@ -180,49 +198,71 @@ class MoleculeBuilder() :
         elif state == 'FAIL' :
             print(f"Step {step}: FAIL ({kwargs['log']})")
 
-    def get_library_allow_brics_list(self) :
-        library_mask = torch.zeros((len(self.library), 17), dtype=torch.bool)
-        for i, brics_label in enumerate(self.library.brics_label_list) : 
-            allow_brics_label_list = brics.constant.BRICS_ENV_INT[brics_label]
-            for allow_brics_label in allow_brics_label_list :
-                library_mask[i, allow_brics_label] = True
-        self.library_mask = library_mask.T  # (self.library, 17)
-    
+    def embed_mol(self, mol) :
+        h = feature.get_atom_features(mol, brics=False).unsqueeze(0)
+        adj = feature.get_adj(mol).unsqueeze(0)
+        _h, Z_mol = self.model.graph_embedding_mol(h, adj, self.cond)
+        return h, adj, _h, Z_mol
+
+    def get_scaffold_embedding(self, scaffold) :
+        # The cached mol is returned together since the embedding follows its atom order.
+        # Both sides get copies so neither the caller nor generate() can alias the cached Mol.
+        scaffold_smiles = Chem.MolToSmiles(scaffold)
+        if scaffold_smiles in self.scaffold_embedding_cache :
+            self.scaffold_embedding_cache.move_to_end(scaffold_smiles)
+        else :
+            self.scaffold_embedding_cache[scaffold_smiles] = (Chem.Mol(scaffold), self.embed_mol(scaffold))
+            if len(self.scaffold_embedding_cache) > self.scaffold_embedding_cache_size :
+                self.scaffold_embedding_cache.popitem(last = False)
+        scaffold, embedding = self.scaffold_embedding_cache[scaffold_smiles]
+        return Chem.Mol(scaffold), embedding
+
     def get_random_scaffold(self, max_try = 20) :
         fragment_idxs = torch.multinomial(self.library_freq_weighted, max_try).tolist()
         for fragment_idx in fragment_idxs :
-            scaffold = self.library.get_mol(fragment_idx)
-            scaffold = brics.preprocess.remove_brics_label(scaffold, returnMol = True)
-            #if not calculateScore(scaffold) < 2.0 :
-            if not (Descriptors.ExactMolWt(scaffold) <= 200 and Descriptors.TPSA(scaffold) <= 40) : 
-                continue
-            if self.cfg.idx_masking :
-                valid = (len(brics.BRICSCompose.get_possible_brics_labels(scaffold)) > 0)
-            else :
-                valid = True
-            if valid :
+            scaffold = self.get_library_scaffold(fragment_idx)
+            if scaffold is not None :
                 return fragment_idx, scaffold
         return None, None
 
+    def get_library_scaffold(self, fragment_idx) :
+        # The scaffold made from each fragment is deterministic, so parse it only once.
+        if fragment_idx in self.scaffold_cache :
+            return self.scaffold_cache[fragment_idx]
+        scaffold = self.library.get_mol(fragment_idx)
+        scaffold = brics.preprocess.remove_brics_label(scaffold, returnMol = True)
+        #if not calculateScore(scaffold) < 2.0 :
+        if not (Descriptors.ExactMolWt(scaffold) <= 200 and Descriptors.TPSA(scaffold) <= 40) : 
+            scaffold = None
+        elif self.cfg.idx_masking and len(brics.BRICSCompose.get_possible_brics_labels(scaffold)) == 0 :
+            scaffold = None
+        self.scaffold_cache[fragment_idx] = scaffold
+        return scaffold
+
     def get_fragment_sample(self, mol) :
         brics_labels = brics.BRICSCompose.get_possible_brics_labels(mol)
-        allow_fragment = torch.zeros((len(self.library),), dtype=torch.bool)
-        for brics_label in brics_labels :
-            allow_fragment += self.library_mask[int(brics_label)]
-        
-        use_lib = torch.arange(len(self.library))[allow_fragment]
+        # Many label combinations share the same connectable fragment labels (at most 186 sets).
+        partner_labels = frozenset(int(partner) for label in brics_labels for partner in brics.constant.BRICS_ENV[label])
+        use_lib, freq = self.get_fragment_candidates(partner_labels)
         if self.n_lib_sample > len(use_lib) :
             return use_lib
         else :
-            freq = self.library_freq_weighted[allow_fragment]
             idxs = torch.multinomial(freq, self.n_lib_sample, False)
             return use_lib[idxs]
 
+    def get_fragment_candidates(self, partner_labels) :
+        # Wrapped with bounded lru_cache in __init__.
+        allow_label = torch.zeros((17,), dtype=torch.bool)
+        allow_label[list(partner_labels)] = True
+        allow_fragment = allow_label[self.library_brics_label]
+        use_lib = torch.arange(len(self.library))[allow_fragment]
+        freq = self.library_freq_weighted[allow_fragment]
+        return use_lib, freq
+
     def get_idx_mask(self, mol: Mol, fragment: Mol) -> BoolTensor:
         idx_mask = torch.ones((mol.GetNumAtoms(),), dtype=torch.bool)
         idxs = brics.BRICSCompose.get_possible_indexs(mol, fragment)
-        for idx, bidx in idxs :
-            idx_mask[idx] = False
+        idx_mask[[idx for idx, bidx in idxs]] = False
         return idx_mask
    
     def load_model(self, model_path) :
@@ -266,24 +306,6 @@ class MoleculeBuilder() :
 
         
     def load_library_feature(self) :
-        # Load node feature / adjacency matrix
-        library_feature_path = os.path.splitext(self.cfg.library_path)[0] + '.npz'
-        if os.path.exists(library_feature_path) :
-            f = np.load(library_feature_path)
-            h = torch.from_numpy(f['h']).float()
-            adj = torch.from_numpy(f['adj']).bool()
-            f.close()
-        else:
-            max_atoms = max([m.GetNumAtoms() for m in self.library.mol])
-            h, adj = [], []
-            for m in self.library.mol :
-                h.append(feature.get_atom_features(m, max_atoms, True))
-                adj.append(feature.get_adj(m, max_atoms))
-
-            h = torch.stack(h)
-            adj = torch.stack(adj)
-            np.savez(library_feature_path, h=h.numpy(), adj=adj.numpy().astype('?'), \
-                     freq=self.library.freq)
-            h = h.float()
-            adj = adj.bool()
+        # Load node feature / adjacency matrix (cached in <library>.npz)
+        h, adj, _ = feature.get_library_feature(library = self.library, library_path = self.cfg.library_path)
         return h, adj
@@ -33,6 +33,6 @@ class GConvLayer(nn.Module) :
         h = self.W(x)
         h = self.dropout(h)
         h = F.relu(torch.einsum('xjk,xkl->xjl', (adj, h)))
-        coeff = torch.sigmoid(self.gate(torch.cat([x,h], -1))).repeat(1,1,x.size(-1))
+        coeff = torch.sigmoid(self.gate(torch.cat([x,h], -1)))     # broadcast over feature dim
         retval = coeff*x+(1-coeff)*h
         return retval
@@ -29,7 +29,7 @@ Shape:
 
 Note:
     if a condition vector exists, it is combined with the nodes feature vector.
-        >> condition = condition.repeat(1, num_nodes, 1) (when the dim of condition is (N, F))
+        >> condition = condition.unsqueeze(1).expand(-1, num_nodes, -1) (when the dim of condition is (N, F))
         >> nodes = torch.cat([nodes, condition], -1)
 
 Output:
@@ -62,8 +62,7 @@ class GraphLinear(nn.Module) :
             cs = condition.size()
             if len(cs) == 2 :   # condition: [B, F]
                 num_nodes = nodes.size(1)
-                condition = condition.unsqueeze(1)
-                condition = condition.repeat(1, num_nodes, 1)
+                condition = condition.unsqueeze(1).expand(-1, num_nodes, -1)
             elif len(cs) == 3 : # condition: [B, N, F]
                 pass
             else :
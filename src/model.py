@@ -72,12 +72,12 @@ class BlockConnectionPredictor(nn.Module) :
         """
         batch_size = Z_mol.size(0)
         if use_lib is None :
-            Z_lib_batch = self.Z_lib.unsqueeze(0).repeat(batch_size, 1, 1)
+            Z_lib_batch = self.Z_lib.unsqueeze(0).expand(batch_size, -1, -1)
         else :
             Z_lib_batch = self.Z_lib[use_lib]                             # (N, N_lib, F)
         n_lib = Z_lib_batch.size(1)
 
-        Z_mol = Z_mol.unsqueeze(1).repeat(1, n_lib, 1)                # (N, N_lib, F+F')
+        Z_mol = Z_mol.unsqueeze(1).expand(-1, n_lib, -1)              # (N, N_lib, F+F')
         y = self.fsm(Z_mol, Z_lib_batch)
 
         if probs :
@@ -131,7 +131,8 @@ class BlockConnectionPredictor(nn.Module) :
 
     @classmethod
     def load(cls, save_file, map_location='cuda') :
-        checkpoint = torch.load(save_file, map_location = map_location)
+        # Load to host first: parameters are copied into the model once, then moved to device.
+        checkpoint = torch.load(save_file, map_location = 'cpu')
         model = cls(checkpoint['config'],checkpoint['cond_scale'])
         model.load_state_dict(checkpoint['model_state_dict'])
         model.to(map_location)
@@ -17,6 +17,42 @@ from .utils.feature import get_library_feature
 bceloss = nn.BCELoss()
 celoss = nn.CrossEntropyLoss()
 
+class CUDAPrefetcher() :
+    """
+    Wrap DataLoader and copy the next batch to GPU on a side stream while the current batch is running.
+    For non-CUDA device, the batches are returned as they are.
+    """
+    def __init__(self, dataloader: DataLoader, device: Union[torch.device, str]) :
+        self.dataloader = dataloader
+        self.device = torch.device(device)
+
+    def __len__(self) :
+        return len(self.dataloader)
+
+    def __iter__(self) :
+        loader = iter(self.dataloader)
+        if self.device.type != 'cuda' :
+            yield from loader
+            return
+        stream = torch.cuda.Stream(self.device)
+        next_batch = self.preload(loader, stream)
+        while next_batch is not None :
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(stream)
+            batch = next_batch
+            for tensor in batch :
+                tensor.record_stream(current_stream)
+            next_batch = self.preload(loader, stream)
+            yield batch
+
+    def preload(self, loader, stream) :
+        try :
+            batch = next(loader)
+        except StopIteration :
+            return None
+        with torch.cuda.stream(stream) :
+            return [tensor.to(self.device, non_blocking=True) for tensor in batch]
+
 class Trainer() :
     def __init__(self, trainer_config, model_config, data_config, properties: List[str], save_dir: str) :
         self.setup_trainer(trainer_config)
@@ -30,7 +66,9 @@ class Trainer() :
 
     def setup_trainer(self, trainer_cfg):
         self.device = 'cuda:0' if trainer_cfg.gpus > 0 else 'cpu'
-        self.num_workers = trainer_cfg.num_workers
+        self.num_workers = trainer_cfg.get('num_workers', None)
+        if self.num_workers is None :
+            self.num_workers = min(os.cpu_count() or 1, 8)
         self.lr = trainer_cfg.lr
         self.n_sample = trainer_cfg.num_negative_samples
         self.alpha = trainer_cfg.alpha
@@ -62,17 +100,25 @@ class Trainer() :
         self.library_h, self.library_adj, self.library_freq = h, adj, freq ** self.alpha
 
     def setup_dataset(self, data_cfg) :
-        self.train_ds = MolBlockPairDataset(data_cfg.train_data_path, self.cond_module, data_cfg.train_max_atoms) 
-        self.val_ds = MolBlockPairDataset(data_cfg.val_data_path, self.cond_module, data_cfg.val_max_atoms) 
+        self.train_ds = MolBlockPairDataset(data_cfg.train_data_path, self.cond_module) 
+        self.val_ds = MolBlockPairDataset(data_cfg.val_data_path, self.cond_module) 
 
         weight = torch.from_numpy(np.load(data_cfg.train_weight_path)).double()
         sampler = WeightedRandomSampler(weight, self.max_step*self.train_batch_size)
-        self.train_dl = DataLoader(self.train_ds, self.train_batch_size, num_workers=self.num_workers, sampler=sampler)
-        self.val_dl = DataLoader(self.val_ds, self.val_batch_size, num_workers=self.num_workers)
+        dataloader_kwargs = self.get_dataloader_kwargs()
+        self.train_dl = DataLoader(self.train_ds, self.train_batch_size, sampler=sampler, **dataloader_kwargs)
+        self.val_dl = DataLoader(self.val_ds, self.val_batch_size, **dataloader_kwargs)
 
         logging.info(f'num of train data: {len(self.train_ds)}')
         logging.info(f'num of val data: {len(self.val_ds)}\n')
 
+    def get_dataloader_kwargs(self) :
+        kwargs = {'num_workers': self.num_workers, 'pin_memory': (self.device != 'cpu'),
+                  'collate_fn': MolBlockPairDataset.collate_fn}
+        if self.num_workers > 0 :
+            kwargs.update(persistent_workers=True, prefetch_factor=4)
+        return kwargs
+
     def fit(self) :
         optimizer = torch.optim.Adam(self.model.parameters(), lr=self.lr)
         self.global_step = 0
@@ -81,7 +127,7 @@ class Trainer() :
         logging.info('Train Start')
         optimizer.zero_grad()
         metrics_storage = self.get_metrics_storage()
-        for h_in, adj_in, cond, y_frag, y_idx in self.train_dl :
+        for h_in, adj_in, cond, y_frag, y_idx in CUDAPrefetcher(self.train_dl, self.device) :
             metrics = self.run_train_step(h_in, adj_in, cond, y_frag, y_idx, optimizer)
             self.log_metrics(metrics, metrics_storage)
 
@@ -104,7 +150,7 @@ class Trainer() :
         self.model.eval()
         self.model_set_Z_lib()
         metrics_storage = self.get_metrics_storage()
-        for h_in, adj_in, cond, y_frag, y_idx in self.val_dl :
+        for h_in, adj_in, cond, y_frag, y_idx in CUDAPrefetcher(self.val_dl, self.device) :
             metrics = self.run_val_step(h_in, adj_in, cond, y_frag, y_idx)
             self.log_metrics(metrics, metrics_storage)
         metrics = self.aggregate_metrics(metrics_storage)
@@ -154,16 +200,16 @@ class Trainer() :
         p_term = self.model.predict_termination(Z_mol)
         term_loss = bceloss(p_term, y_term.float())
 
+        # Find the kept rows once; each boolean-mask indexing would run (and sync on) its own nonzero.
+        keep_idx = torch.nonzero(y_not_term, as_tuple=True)[0]
         if cond is not None :
-            h, adj, cond = h[y_not_term], adj[y_not_term], cond[y_not_term]
-        else :
-            h, adj = h[y_not_term], adj[y_not_term]
-        y_frag, y_idx = y_frag[y_not_term], y_idx[y_not_term]
-        _h, Z_mol = _h[y_not_term], Z_mol[y_not_term]
+            cond = cond.index_select(0, keep_idx)
+        h, adj, y_frag, y_idx, _h, Z_mol = \
+                [t.index_select(0, keep_idx) for t in (h, adj, y_frag, y_idx, _h, Z_mol)]
    
         if h.size(0) == 0 :
-            loss = term_loss
-            metrics = {'loss' : loss.item(), 'term_loss' : term_loss.item()}
+            loss = term_loss.item()
+            metrics = {'loss' : loss, 'term_loss' : loss}
             return term_loss, metrics
 
         if train :
@@ -190,10 +236,10 @@ class Trainer() :
         idx_loss = celoss(logit_idx, y_idx)
 
         loss = term_loss + frag_ploss + frag_nloss + idx_loss
-        metrics = {
-            'loss' : loss.item(), 'term_loss' : term_loss.item(),
-            'frag_ploss' : frag_ploss.item(), 'frag_nloss' : frag_nloss.item(), 'idx_loss' : idx_loss.item()
-        }
+        # Gather all losses with a single device-to-host transfer.
+        metric_keys = ('loss', 'term_loss', 'frag_ploss', 'frag_nloss', 'idx_loss')
+        metric_values = torch.stack([loss, term_loss, frag_ploss, frag_nloss, idx_loss]).detach().tolist()
+        metrics = dict(zip(metric_keys, metric_values))
         return loss, metrics
 
     """
@@ -6,7 +6,6 @@ from rdkit.Chem import rdChemReactions as Reactions
 from typing import Union, List, Tuple, Optional, Dict
 import re
 import pandas as pd
-import gc
 
 from .constant import BRICS_ENV, BRICS_SMARTS_MOL, BRICS_SMARTS_FRAG
 
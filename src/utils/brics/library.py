@@ -2,7 +2,6 @@ from rdkit import Chem
 import pandas as pd
 import numpy as np
 from typing import Union, List, Optional
-import gc
 import re
 
 p = re.compile('\[\d+\*\]')
@@ -5,6 +5,7 @@ import numpy as np
 import torch
 from torch import FloatTensor, BoolTensor
 from typing import Union, Tuple, Optional, List
+import functools
 import os
 
 from .brics import BRICSLibrary
@@ -68,12 +69,13 @@ def get_atom_features(mol: Union[Mol,str],
     if max_atoms is None :
         max_atoms = mol.GetNumAtoms()
     if brics :
-        af = torch.zeros((max_atoms, NUM_ATOM_FEATURES_BRICS), dtype=torch.float)
+        af = np.zeros((max_atoms, NUM_ATOM_FEATURES_BRICS), dtype=np.float32)
     else :
-        af = torch.zeros((max_atoms, NUM_ATOM_FEATURES), dtype=torch.float)
-    for idx, atom in enumerate(mol.GetAtoms()) :
-        af[idx, :] = torch.Tensor(_atom_features(atom, brics))
-    return af
+        af = np.zeros((max_atoms, NUM_ATOM_FEATURES), dtype=np.float32)
+    # Fill all atoms with one numpy assignment instead of creating a tensor per atom.
+    if mol.GetNumAtoms() > 0 :
+        af[:mol.GetNumAtoms()] = [_atom_features(atom, brics) for atom in mol.GetAtoms()]
+    return torch.from_numpy(af)
 
 def get_adj(mol: Union[Mol,str],
             max_atoms: Optional[int] = None) -> BoolTensor :
@@ -81,10 +83,10 @@ def get_adj(mol: Union[Mol,str],
         mol = Chem.MolFromSmiles(mol)
     if max_atoms is None :
         max_atoms = mol.GetNumAtoms()
-    adj = GetAdjacencyMatrix(mol) + np.eye(mol.GetNumAtoms())
+    n_atom = mol.GetNumAtoms()
     padded_adj = np.zeros((max_atoms, max_atoms), dtype='b')
-    n_atom = len(adj)
-    padded_adj[:n_atom, :n_atom] = adj
+    padded_adj[:n_atom, :n_atom] = GetAdjacencyMatrix(mol)
+    padded_adj[range(n_atom), range(n_atom)] = 1         # self-loop
     return torch.from_numpy(padded_adj)
 
 def get_library_feature(library: BRICSLibrary = None,
@@ -95,7 +97,7 @@ def get_library_feature(library: BRICSLibrary = None,
     assert (library_path is not None) or (library_feature_path is not None)
     if library_feature_path is None :
         library_feature_path = os.path.splitext(library_path)[0] + '.npz'
-    if os.path.exists(library_feature_path) :
+    if _is_valid_cache(library_feature_path, library_path) :
         f = np.load(library_feature_path)
         v = torch.from_numpy(f['h']).float().to(device)
         adj = torch.from_numpy(f['adj']).bool().to(device)
@@ -104,14 +106,14 @@ def get_library_feature(library: BRICSLibrary = None,
     else:
         if library is None :
             library = BRICSLibrary(library_path)
-        max_atoms = max([m.GetNumAtoms() for m in library.mol])
-        v, adj = [], []
-        for m in library.mol :
-            v.append(get_atom_features(m, max_atoms, True))
-            adj.append(get_adj(m, max_atoms))
-
-        v = torch.stack(v)
-        adj = torch.stack(adj)
+        library_mol = library.mol
+        max_atoms = max([m.GetNumAtoms() for m in library_mol])
+        v = torch.zeros((len(library_mol), max_atoms, NUM_ATOM_FEATURES_BRICS), dtype=torch.float)
+        adj = torch.zeros((len(library_mol), max_atoms, max_atoms), dtype=torch.int8)
+        for i, m in enumerate(library_mol) :
+            v[i] = get_atom_features(m, max_atoms, True)
+            adj[i] = get_adj(m, max_atoms)
+
         freq = library.freq
         np.savez(library_feature_path, h=v.numpy(), adj=adj.numpy().astype('?'), \
                  freq=freq)
@@ -121,6 +123,14 @@ def get_library_feature(library: BRICSLibrary = None,
         
     return v, adj, freq
 
+def _is_valid_cache(cache_path: str, source_path: Optional[str]) -> bool :
+    # Cached feature file is stale when the library file is modified after it.
+    if not os.path.exists(cache_path) :
+        return False
+    if source_path is None or not os.path.exists(source_path) :
+        return True
+    return os.path.getmtime(cache_path) >= os.path.getmtime(source_path)
+
 def _atom_features(atom: Atom, brics: bool) -> List[Union[int, float]]:
     atomic_num = atom.GetAtomicNum()
     period, group = _get_periodic_feature(atomic_num)
@@ -150,6 +160,7 @@ def _atom_features(atom: Atom, brics: bool) -> List[Union[int, float]]:
     return features
                
 _periodic_table = Chem.GetPeriodicTable()
+@functools.lru_cache(maxsize=None)
 def _get_periodic_feature(atomic_num: int) :
     periodic_list = [0, 2, 10, 18, 36, 54]
     for i in range(len(periodic_list)) :
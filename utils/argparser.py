@@ -42,6 +42,7 @@ class Generation_ArgParser(configargparse.ArgParser) :
         opt_args.add_argument('-o', '--output_path', type=str, help='output file name')
         opt_args.add_argument('--seed', type=int, help='explicit random seed')
         opt_args.add_argument('--num_samples', type=int, help='number of generation', default=1)
+        opt_args.add_argument('--num_workers', type=int, help='number of processes for generation (>1 requires fork, POSIX only)', default=1)
         opt_args.add_argument('--verbose', action='store_true', help='print generating message')
         opt_args.add_argument('-q', action='store_true', help='no print sampling script message')
 